@@ -0,0 +1,139 @@
+import json
+import argparse
+from pathlib import Path
+
+
+LARGURA_BARRA = 40
+
+
+def carregar_spans(caminho: Path) -> list[dict]:
+    """Lê um trace OTLP/JSON (main.py + index-send-message.ts) e devolve os spans achatados."""
+    trace = json.loads(caminho.read_text(encoding="utf-8"))
+    spans = []
+
+    for resource_spans in trace.get("resourceSpans", []):
+        servico = "?"
+        for atributo in resource_spans.get("resource", {}).get("attributes", []):
+            if atributo.get("key") == "service.name":
+                servico = atributo.get("value", {}).get("stringValue", "?")
+
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            for span in scope_spans.get("spans", []):
+                inicio = int(span["startTimeUnixNano"])
+                fim = int(span["endTimeUnixNano"])
+                spans.append({
+                    "id": span["spanId"],
+                    "pai": span.get("parentSpanId") or None,
+                    "nome": span["name"],
+                    "servico": servico,
+                    "inicio": inicio,
+                    "duracao_ms": (fim - inicio) / 1_000_000,
+                    "erro": span.get("status", {}).get("code") == 2,
+                })
+
+    return spans
+
+
+def imprimir_flame(caminho: Path, spans: list[dict]) -> None:
+    """Imprime a árvore de spans com barras proporcionais à duração (estilo flame graph)."""
+    if not spans:
+        print(f"⚠️ Nenhum span em {caminho}")
+        return
+
+    ids = {s["id"] for s in spans}
+    filhos: dict[str | None, list[dict]] = {}
+    for s in spans:
+        # Pai ausente no arquivo (ex: processo que não gravou) vira raiz
+        pai = s["pai"] if s["pai"] in ids else None
+        filhos.setdefault(pai, []).append(s)
+    for lista in filhos.values():
+        lista.sort(key=lambda s: s["inicio"])
+
+    raizes = filhos.get(None, [])
+    total_ms = sum(r["duracao_ms"] for r in raizes) or 1.0
+
+    print("\n" + "=" * 70)
+    print(f"🔥 {caminho} — total {total_ms / 1000:.2f}s")
+    print("=" * 70)
+
+    def imprimir(span: dict, nivel: int) -> None:
+        proporcao = span["duracao_ms"] / total_ms
+        barra = "█" * max(1, round(proporcao * LARGURA_BARRA))
+        marca = " ❌" if span["erro"] else ""
+        nome = f"{'  ' * nivel}{span['nome']}"
+        print(f"{nome:<42} {span['duracao_ms']:>10.1f} ms {proporcao * 100:5.1f}% {barra}{marca}")
+        for filho in filhos.get(span["id"], []):
+            imprimir(filho, nivel + 1)
+
+    for raiz in raizes:
+        print(f"\n[{raiz['servico']}]")
+        imprimir(raiz, 0)
+
+
+def totais_por_fase(spans: list[dict]) -> dict[str, float]:
+    totais: dict[str, float] = {}
+    for s in spans:
+        totais[s["nome"]] = totais.get(s["nome"], 0.0) + s["duracao_ms"]
+    return totais
+
+
+def comparar(traces: list[tuple[Path, list[dict]]]) -> None:
+    """Compara o tempo total por fase entre runs; a variação é sempre em relação ao primeiro."""
+    totais = [totais_por_fase(spans) for _, spans in traces]
+    fases = sorted({fase for t in totais for fase in t}, key=lambda f: -max(t.get(f, 0.0) for t in totais))
+
+    print("\n" + "=" * 70)
+    print("📊 COMPARAÇÃO ENTRE RUNS (ms)")
+    print("=" * 70)
+    for i, (caminho, _) in enumerate(traces):
+        print(f"  [{i}] {caminho}")
+
+    cabecalho = f"\n{'fase':<40}" + "".join(f"{f'[{i}]':>12}" for i in range(len(traces))) + f"{'Δ último':>12}"
+    print(cabecalho)
+
+    for fase in fases:
+        valores = [t.get(fase) for t in totais]
+        colunas = "".join(f"{v:>12.1f}" if v is not None else f"{'-':>12}" for v in valores)
+        base, ultimo = valores[0], valores[-1]
+        if base is not None and ultimo is not None:
+            delta = f"{ultimo - base:>+12.1f}"
+        else:
+            delta = f"{'-':>12}"
+        print(f"{fase:<40}{colunas}{delta}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analisar traces do devocional (trace.json)")
+    parser.add_argument(
+        "traces",
+        nargs="*",
+        type=Path,
+        default=[Path("trace.json")],
+        help="Arquivos trace.json (dois ou mais para comparar runs)"
+    )
+    parser.add_argument(
+        "--sem-flame",
+        action="store_true",
+        help="Mostrar apenas a comparação entre runs"
+    )
+
+    args = parser.parse_args()
+
+    traces = []
+    for caminho in args.traces:
+        if not caminho.exists():
+            print(f"❌ Trace não encontrado: {caminho}")
+            continue
+        traces.append((caminho, carregar_spans(caminho)))
+
+    if not args.sem_flame:
+        for caminho, spans in traces:
+            imprimir_flame(caminho, spans)
+
+    if len(traces) > 1:
+        comparar(traces)
+
+
+if __name__ == "__main__":
+    main()
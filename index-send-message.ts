@@ -2,6 +2,8 @@ import makeWASocket, { DisconnectReason, useMultiFileAuthState, WAMessageStatus,
 import { Boom } from '@hapi/boom'
 import qrcode from 'qrcode-terminal'
 import { readFileSync, writeFileSync, existsSync } from 'fs'
+import { randomBytes } from 'crypto'
+import { performance } from 'perf_hooks'
 
 process.env.NODE_TLS_REJECT_UNAUTHORIZED = '0'
 
@@ -16,6 +18,152 @@ interface SendStatus {
 const STATUS_FILE = 'send_status.json'
 const OUTBOX_FILE = 'outbox.txt'
 const AUTH_DIR = 'auth_info_baileys'
+const TRACE_FILE = 'trace.json'
+// Trace do main.py mais antigo que isso é de outro run e não é reaproveitado
+const TRACE_REUSE_MAX_AGE_MS = 10 * 60_000
+const RECEIPT_TIMEOUT_MESSAGE = 'Timeout esperando delivery/receipt'
+
+// Spans no formato OTLP/JSON, compartilhando o trace id com o main.py
+interface TraceSpan {
+    traceId: string
+    spanId: string
+    parentSpanId?: string
+    name: string
+    kind: number
+    startTimeUnixNano: string
+    endTimeUnixNano: string
+    attributes: { key: string; value: { stringValue?: string; intValue?: string; boolValue?: boolean } }[]
+    status: { code: number; message?: string }
+}
+
+interface OpenSpan {
+    end: (error?: unknown) => void
+    setAttribute: (key: string, value: string | number | boolean) => void
+}
+
+function toUnixNano(ms: number): string {
+    // Microssegundos cabem com folga em um number; completa com zeros para nanos
+    return String(Math.round(ms * 1000)) + '000'
+}
+
+function nowUnixNano(): string {
+    return toUnixNano(performance.timeOrigin + performance.now())
+}
+
+function readTraceFile(): any | null {
+    try {
+        if (!existsSync(TRACE_FILE)) return null
+        return JSON.parse(readFileSync(TRACE_FILE, 'utf-8'))
+    } catch {
+        return null
+    }
+}
+
+function serviceName(resourceSpans: any): string | undefined {
+    return resourceSpans?.resource?.attributes
+        ?.find((a: any) => a?.key === 'service.name')?.value?.stringValue
+}
+
+function recentMainTraceId(): string | undefined {
+    // Execução local: só reaproveita o trace id se o root do main.py terminou há pouco
+    const previous = readTraceFile()
+    for (const rs of previous?.resourceSpans || []) {
+        if (serviceName(rs) !== 'devocional-main') continue
+        for (const ss of rs?.scopeSpans || []) {
+            for (const sp of ss?.spans || []) {
+                if (sp?.parentSpanId || typeof sp?.traceId !== 'string') continue
+                const endedMs = Number(sp.endTimeUnixNano) / 1e6
+                if (Date.now() - endedMs <= TRACE_REUSE_MAX_AGE_MS) return sp.traceId
+            }
+        }
+    }
+    return undefined
+}
+
+function resolveTraceId(): string {
+    return process.env.TRACE_ID || recentMainTraceId() || randomBytes(16).toString('hex')
+}
+
+const TRACE_ID = resolveTraceId()
+const spans: TraceSpan[] = []
+
+function startSpan(name: string, parent?: string, start = nowUnixNano()): OpenSpan & { spanId: string } {
+    const spanId = randomBytes(8).toString('hex')
+    const attributes: TraceSpan['attributes'] = []
+    let ended = false
+
+    return {
+        spanId,
+        setAttribute(key, value) {
+            if (typeof value === 'boolean') attributes.push({ key, value: { boolValue: value } })
+            else if (typeof value === 'number') attributes.push({ key, value: { intValue: String(Math.round(value)) } })
+            else attributes.push({ key, value: { stringValue: value } })
+        },
+        end(error?: unknown) {
+            if (ended) return
+            ended = true
+            spans.push({
+                traceId: TRACE_ID,
+                spanId,
+                parentSpanId: parent,
+                name,
+                kind: 1,
+                startTimeUnixNano: start,
+                endTimeUnixNano: nowUnixNano(),
+                attributes,
+                status: error === undefined
+                    ? { code: 1 }
+                    : { code: 2, message: error instanceof Error ? error.message : String(error) },
+            })
+        },
+    }
+}
+
+// O root começa na origem do processo para incluir o import/transpile dos módulos (Baileys etc.)
+const processStart = toUnixNano(performance.timeOrigin)
+const rootSpan = startSpan('index-send-message.ts', undefined, processStart)
+startSpan('import baileys', rootSpan.spanId, processStart).end()
+
+async function traced<T>(name: string, fn: () => Promise<T>): Promise<T> {
+    const span = startSpan(name, rootSpan.spanId)
+    try {
+        const result = await fn()
+        span.end()
+        return result
+    } catch (err) {
+        span.end(err)
+        throw err
+    }
+}
+
+function saveTrace(code: number) {
+    rootSpan.end(code === 0 ? undefined : `exit code ${code}`)
+    const previous = readTraceFile()
+    // Mantém só os blocos do main.py do mesmo run; um sender anterior (retry) é substituído
+    const resourceSpans = (previous?.resourceSpans || []).filter((rs: any) =>
+        serviceName(rs) !== 'devocional-sender' &&
+        rs?.scopeSpans?.some((ss: any) => ss?.spans?.some((sp: any) => sp?.traceId === TRACE_ID)))
+
+    resourceSpans.push({
+        resource: {
+            attributes: [
+                { key: 'service.name', value: { stringValue: 'devocional-sender' } },
+                { key: 'run.id', value: { stringValue: TRACE_ID } },
+                { key: 'github.run_id', value: { stringValue: process.env.GITHUB_RUN_ID || 'local' } },
+            ],
+        },
+        scopeSpans: [{ scope: { name: 'index-send-message.ts' }, spans }],
+    })
+
+    try {
+        writeFileSync(TRACE_FILE, JSON.stringify({ resourceSpans }, null, 2))
+    } catch (err) {
+        console.warn('⚠️ Não consegui salvar o trace:', err)
+    }
+}
+
+// Todas as saídas passam por process.exit, então o trace é gravado aqui de forma síncrona
+process.on('exit', saveTrace)
 
 function writeStatus(status: SendStatus) {
     writeFileSync(STATUS_FILE, JSON.stringify(status, null, 2))
@@ -31,8 +179,9 @@ function safeReadStatus(): SendStatus | null {
 }
 
 async function connectToWhatsApp() {
-    const { state, saveCreds } = await useMultiFileAuthState(AUTH_DIR)
-    const { version } = await fetchLatestBaileysVersion()
+    const { state, saveCreds } = await traced('baileys.useMultiFileAuthState', () => useMultiFileAuthState(AUTH_DIR))
+    const { version } = await traced('baileys.fetchLatestBaileysVersion', () => fetchLatestBaileysVersion())
+    const handshakeSpan = startSpan('baileys.handshake', rootSpan.spanId)
     const sock = makeWASocket({
         auth: state,
         version,
@@ -81,6 +230,7 @@ async function connectToWhatsApp() {
             const message = lastDisconnect?.error?.message || 'Conexão fechada'
 
             console.log('Conexão fechada:', message)
+            handshakeSpan.end(lastDisconnect?.error || message)
 
             if (!sent) {
                 const previous = safeReadStatus()
@@ -105,7 +255,8 @@ async function connectToWhatsApp() {
 
         if (connection === 'open') {
             console.log('✅ Conexão estabelecida com WhatsApp')
-            await new Promise(resolve => setTimeout(resolve, 5000))
+            handshakeSpan.end()
+            await traced('espera.fixa_5s', () => new Promise(resolve => setTimeout(resolve, 5000)))
 
             try {
                 const mensagem = readFileSync(OUTBOX_FILE, 'utf-8')
@@ -113,10 +264,11 @@ async function connectToWhatsApp() {
                 // Normaliza: contatos individuais devem usar @s.whatsapp.net
                 const groupId = rawId.replace('@s.whatsapp.us', '@s.whatsapp.net')
                 const isGroup = groupId.endsWith('@g.us')
+                rootSpan.setAttribute('destino.grupo', isGroup)
 
                 if (isGroup) {
                     try {
-                        const groupMetadata = await sock.groupMetadata(groupId)
+                        const groupMetadata = await traced('baileys.groupMetadata', () => sock.groupMetadata(groupId))
                         console.log(`📱 Grupo encontrado: ${groupMetadata.subject}`)
                     } catch (metaError: any) {
                         throw new Error(`Grupo não encontrado ou inacessível: ${metaError?.message || metaError}`)
@@ -126,7 +278,7 @@ async function connectToWhatsApp() {
                 }
 
                 console.log('📤 Enviando mensagem...')
-                const result = await sock.sendMessage(groupId, { text: mensagem })
+                const result = await traced('baileys.sendMessage', () => sock.sendMessage(groupId, { text: mensagem }))
 
                 if (!result?.key) {
                     throw new Error('Resposta inválida do sendMessage (sem key)')
@@ -134,6 +286,7 @@ async function connectToWhatsApp() {
 
                 lastMessageKey = result.key
                 sent = true
+                rootSpan.setAttribute('envio.sucesso', true)
 
                 writeStatus({
                     success: true,
@@ -144,10 +297,17 @@ async function connectToWhatsApp() {
 
                 console.log('✅ Mensagem enviada com sucesso!')
 
+                const receiptSpan = startSpan('baileys.waitForDeliveredOrReceipt', rootSpan.spanId)
                 try {
                     await waitForDeliveredOrReceipt(sock, lastMessageKey, receiptTimeoutMs)
+                    receiptSpan.setAttribute('receipt.confirmado', true)
+                    receiptSpan.end()
                     console.log('📬 Delivery/receipt confirmado.')
-                } catch {
+                } catch (receiptError) {
+                    // Timeout é o desfecho normal em grupo: span OK, só marca que não houve receipt
+                    receiptSpan.setAttribute('receipt.confirmado', false)
+                    const isTimeout = receiptError instanceof Error && receiptError.message === RECEIPT_TIMEOUT_MESSAGE
+                    receiptSpan.end(isTimeout ? undefined : receiptError)
                     console.warn('⚠️ Sem receipt a tempo (normal em grupo). Seguindo…')
                 }
 
@@ -178,7 +338,7 @@ async function connectToWhatsApp() {
 
             const t = setTimeout(() => {
                 cleanup()
-                reject(new Error('Timeout esperando delivery/receipt'))
+                reject(new Error(RECEIPT_TIMEOUT_MESSAGE))
             }, timeoutMs)
 
             const onMsgUpdate = (updates: any[]) => {
@@ -4,14 +4,23 @@ import re
 import json
 import sys
 import unicodedata
+import time
+import secrets
+from collections.abc import Callable
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 
+# Marca o início do processo antes do import do SDK para medir o custo do import no trace
+_INICIO_PROCESSO_NS = time.time_ns()
+
 from google import genai
 from google.genai import errors as genai_errors
+
+_FIM_IMPORT_SDK_NS = time.time_ns()
+
 from dotenv import load_dotenv
 import ssl
-import time
 import hashlib
 import random
 
@@ -31,12 +40,101 @@ GOOGLE_CLOUD_PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT")
 GEMINI_LOCATION = os.getenv("GEMINI_LOCATION", "global")
 GEMINI_MODELS = os.getenv("GEMINI_MODELS", "gemini-3.5-flash,gemini-2.5-flash")
 TEST_MODE = os.getenv("TEST_MODE", "0") == "1"
+# Lease do run: TTL renovado a cada tentativa no Gemini; espera 0 = sai na hora se outro run estiver ativo
+LEASE_TTL_SEGUNDOS = float(os.getenv("LEASE_TTL_SEGUNDOS", "600"))
+LEASE_ESPERA_SEGUNDOS = float(os.getenv("LEASE_ESPERA_SEGUNDOS", "0"))
+# Código de saída quando outro run tem o lease: diferencia de sucesso e de erro comum (1)
+EXIT_LEASE_OCUPADO = 3
 
 BASE_DIR = Path(__file__).resolve().parent
 DB_PATH = BASE_DIR / "database.db"
 OUTBOX_PATH = BASE_DIR / "outbox.txt"
 SEND_STATUS_PATH = BASE_DIR / "send_status.json"
 NODE_SENDER_PATH = BASE_DIR / "index-send-message.ts"
+TRACE_PATH = BASE_DIR / "trace.json"
+
+# Trace compartilhado com o index-send-message.ts: no CI o TRACE_ID vem do workflow
+TRACE_ID = os.getenv("TRACE_ID") or secrets.token_hex(16)
+
+_spans: list[dict] = []
+_pilha_spans: list[str] = []
+
+def _atributo_otlp(chave: str, valor) -> dict:
+    if isinstance(valor, bool):
+        return {"key": chave, "value": {"boolValue": valor}}
+    if isinstance(valor, int):
+        return {"key": chave, "value": {"intValue": str(valor)}}
+    if isinstance(valor, float):
+        return {"key": chave, "value": {"doubleValue": valor}}
+    return {"key": chave, "value": {"stringValue": str(valor)}}
+
+def registrar_span(
+    nome: str,
+    inicio_ns: int,
+    fim_ns: int,
+    span_id: str | None = None,
+    parent_id: str | None = None,
+    atributos: dict | None = None,
+    erro: str | None = None,
+) -> str:
+    span_id = span_id or secrets.token_hex(8)
+    if parent_id is None and _pilha_spans:
+        parent_id = _pilha_spans[-1]
+
+    registro = {
+        "traceId": TRACE_ID,
+        "spanId": span_id,
+        "name": nome,
+        "kind": 1,
+        "startTimeUnixNano": str(inicio_ns),
+        "endTimeUnixNano": str(fim_ns),
+        "attributes": [_atributo_otlp(k, v) for k, v in (atributos or {}).items()],
+        "status": {"code": 2, "message": erro} if erro else {"code": 1},
+    }
+    if parent_id:
+        registro["parentSpanId"] = parent_id
+    _spans.append(registro)
+    return span_id
+
+@contextmanager
+def span(nome: str, inicio_ns: int | None = None, **atributos):
+    """Mede um trecho do job. O dict retornado aceita atributos extras até o fim do bloco."""
+    span_id = secrets.token_hex(8)
+    parent_id = _pilha_spans[-1] if _pilha_spans else None
+    inicio = inicio_ns or time.time_ns()
+    erro = None
+    _pilha_spans.append(span_id)
+    try:
+        yield atributos
+    except BaseException as e:
+        erro = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _pilha_spans.pop()
+        registrar_span(nome, inicio, time.time_ns(), span_id=span_id, parent_id=parent_id,
+                       atributos=atributos, erro=erro)
+
+def salvar_trace() -> None:
+    """Grava os spans no formato OTLP/JSON; o sender Node acrescenta os dele no mesmo arquivo."""
+    trace = {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        _atributo_otlp("service.name", "devocional-main"),
+                        _atributo_otlp("run.id", TRACE_ID),
+                        _atributo_otlp("github.run_id", os.getenv("GITHUB_RUN_ID", "local")),
+                    ]
+                },
+                "scopeSpans": [{"scope": {"name": "main.py"}, "spans": _spans}],
+            }
+        ]
+    }
+    try:
+        TRACE_PATH.write_text(json.dumps(trace, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"ℹ️ Trace salvo em {TRACE_PATH.name} (trace_id={TRACE_ID})")
+    except OSError as e:
+        print(f"⚠️ Não consegui salvar o trace: {e}")
 
 def criar_cliente_genai() -> genai.Client:
     usar_vertex_env = os.getenv("GOOGLE_GENAI_USE_VERTEXAI")
@@ -81,6 +179,17 @@ def column_exists(conn: sqlite3.Connection, table: str, column: str) -> bool:
     cols = [row[1] for row in cur.fetchall()]
     return column in cols
 
+def adicionar_coluna(conn: sqlite3.Connection, table: str, column: str, tipo: str) -> None:
+    if column_exists(conn, table, column):
+        return
+    try:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {tipo}")
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        # Outro processo pode ter migrado entre o check e o ALTER (banco novo com runs em paralelo)
+        if "duplicate column" not in str(e).lower():
+            raise
+
 def init_db(conn: sqlite3.Connection) -> None:
     cursor = conn.cursor()
 
@@ -93,29 +202,12 @@ def init_db(conn: sqlite3.Connection) -> None:
     """)
     conn.commit()
 
-    if not column_exists(conn, "devocionais", "referencia"):
-        cursor.execute("ALTER TABLE devocionais ADD COLUMN referencia TEXT")
-        conn.commit()
-
-    if not column_exists(conn, "devocionais", "hash_mensagem"):
-        cursor.execute("ALTER TABLE devocionais ADD COLUMN hash_mensagem TEXT")
-        conn.commit()
-
-    if not column_exists(conn, "devocionais", "livro"):
-        cursor.execute("ALTER TABLE devocionais ADD COLUMN livro TEXT")
-        conn.commit()
-
-    if not column_exists(conn, "devocionais", "capitulo"):
-        cursor.execute("ALTER TABLE devocionais ADD COLUMN capitulo INTEGER")
-        conn.commit()
-
-    if not column_exists(conn, "devocionais", "verso_inicial"):
-        cursor.execute("ALTER TABLE devocionais ADD COLUMN verso_inicial INTEGER")
-        conn.commit()
-
-    if not column_exists(conn, "devocionais", "verso_final"):
-        cursor.execute("ALTER TABLE devocionais ADD COLUMN verso_final INTEGER")
-        conn.commit()
+    adicionar_coluna(conn, "devocionais", "referencia", "TEXT")
+    adicionar_coluna(conn, "devocionais", "hash_mensagem", "TEXT")
+    adicionar_coluna(conn, "devocionais", "livro", "TEXT")
+    adicionar_coluna(conn, "devocionais", "capitulo", "INTEGER")
+    adicionar_coluna(conn, "devocionais", "verso_inicial", "INTEGER")
+    adicionar_coluna(conn, "devocionais", "verso_final", "INTEGER")
 
     cursor.execute("""
         CREATE UNIQUE INDEX IF NOT EXISTS idx_devocionais_hash_unique
@@ -123,6 +215,75 @@ def init_db(conn: sqlite3.Connection) -> None:
     """)
     conn.commit()
 
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS lease_execucao (
+            chave TEXT PRIMARY KEY,
+            dono TEXT NOT NULL,
+            heartbeat REAL NOT NULL,
+            expira_em REAL NOT NULL
+        )
+    """)
+    conn.commit()
+
+def adquirir_lease(
+    conn: sqlite3.Connection,
+    chave: str,
+    dono: str,
+    ttl: float = LEASE_TTL_SEGUNDOS,
+    espera_max: float = LEASE_ESPERA_SEGUNDOS,
+) -> bool:
+    """Tenta pegar o lease da chave; lease expirado (run morto) é retomado. Devolve False se esgotar a espera."""
+    limite = time.monotonic() + espera_max
+
+    while True:
+        # BEGIN IMMEDIATE pega o lock de escrita já na leitura: dois runs não podem ver o lease livre ao mesmo tempo
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            agora = time.time()
+            row = conn.execute(
+                "SELECT dono, expira_em FROM lease_execucao WHERE chave = ?", (chave,)
+            ).fetchone()
+
+            if row is None or row[0] == dono or row[1] < agora:
+                if row is not None and row[0] != dono:
+                    print(f"⚠️ Lease expirado de {row[0]} retomado.")
+                conn.execute(
+                    """INSERT INTO lease_execucao (chave, dono, heartbeat, expira_em)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(chave) DO UPDATE SET
+                        dono = excluded.dono,
+                        heartbeat = excluded.heartbeat,
+                        expira_em = excluded.expira_em""",
+                    (chave, dono, agora, agora + ttl),
+                )
+                conn.commit()
+                return True
+
+            conn.rollback()
+        except BaseException:
+            conn.rollback()
+            raise
+
+        if time.monotonic() >= limite:
+            print(f"⚠️ Outro run ({row[0]}) está com o lease de {chave}.")
+            return False
+
+        time.sleep(min(2.0, max(0.1, limite - time.monotonic())))
+
+def renovar_lease(conn: sqlite3.Connection, chave: str, dono: str, ttl: float = LEASE_TTL_SEGUNDOS) -> None:
+    agora = time.time()
+    cursor = conn.execute(
+        "UPDATE lease_execucao SET heartbeat = ?, expira_em = ? WHERE chave = ? AND dono = ?",
+        (agora, agora + ttl, chave, dono),
+    )
+    conn.commit()
+    if cursor.rowcount == 0:
+        raise RuntimeError(f"Lease de {chave} perdido para outro run (heartbeat atrasado?).")
+
+def liberar_lease(conn: sqlite3.Connection, chave: str, dono: str) -> None:
+    conn.execute("DELETE FROM lease_execucao WHERE chave = ? AND dono = ?", (chave, dono))
+    conn.commit()
+
 def normalizar_livro(livro: str) -> str:
     """Remove acentos e converte para minúsculas para comparação normalizada."""
     nfkd = unicodedata.normalize('NFKD', livro.strip())
@@ -247,7 +408,12 @@ def _erro_eh_quota_excedida(err: Exception) -> bool:
     msg = str(err).lower()
     return "429" in msg or "resource_exhausted" in msg or "quota exceeded" in msg
 
-def gerar_devocional(client: genai.Client, cursor: sqlite3.Cursor, data: str) -> tuple[str, str]:
+def gerar_devocional(
+    client: genai.Client,
+    cursor: sqlite3.Cursor,
+    data: str,
+    heartbeat: Callable[[], None] | None = None,
+) -> tuple[str, str]:
     modelos = [m.strip() for m in GEMINI_MODELS.split(",") if m.strip()]
     if not modelos:
         modelos = ["gemini-3.5-flash"]
@@ -260,6 +426,9 @@ def gerar_devocional(client: genai.Client, cursor: sqlite3.Cursor, data: str) ->
     modelos_sem_quota: set[str] = set()
 
     for tentativa in range(max_tentativas):
+        if heartbeat:
+            heartbeat()
+
         modelos_disponiveis = [m for m in modelos if m not in modelos_sem_quota]
         if not modelos_disponiveis:
             raise RuntimeError("Sem quota disponível nos modelos configurados do Gemini. Ajuste GEMINI_MODELS ou cota/faturamento.")
@@ -267,9 +436,10 @@ def gerar_devocional(client: genai.Client, cursor: sqlite3.Cursor, data: str) ->
         model = modelos_disponiveis[tentativa % len(modelos_disponiveis)]
 
         try:
-            response = client.models.generate_content(
-                model=model,
-                contents=f"""
+            with span("gemini.generate_content", modelo=model, tentativa=tentativa + 1):
+                response = client.models.generate_content(
+                    model=model,
+                    contents=f"""
         Hoje é {data}.
 
         Você é um escritor cristão comprometido com a fidelidade bíblica. Escreva um devocional inédito, curto, acolhedor e edificante, baseado exclusivamente nas Escrituras.
@@ -342,13 +512,14 @@ def gerar_devocional(client: genai.Client, cursor: sqlite3.Cursor, data: str) ->
         - Não ultrapasse os limites de palavras.
         - A saída deve conter apenas o texto final do devocional.
         """.strip(),
-            )
+                )
 
         except genai_errors.ServerError as e:
             tentativas_503 += 1
             wait = min(45, 8 * tentativas_503)
             print(f"⚠️ Servidor ocupado (503). Aguardando {wait}s para tentar novamente...")
-            time.sleep(wait)
+            with span("gemini.backoff", motivo="503", segundos=wait):
+                time.sleep(wait)
             continue
         except Exception as e:
             if _erro_eh_quota_excedida(e):
@@ -359,7 +530,8 @@ def gerar_devocional(client: genai.Client, cursor: sqlite3.Cursor, data: str) ->
             # qualquer outro erro: também tenta mais uma vez, mas sem loop infinito
             wait = min(30, 2 ** tentativa) + random.uniform(0, 1.0)
             print(f"⚠️ Erro inesperado no Gemini: {e}. Retry em {wait:.1f}s...")
-            time.sleep(wait)
+            with span("gemini.backoff", motivo="erro", segundos=round(wait, 1)):
+                time.sleep(wait)
             continue
 
         text = getattr(response, "text", None)
@@ -415,7 +587,8 @@ def read_send_status() -> dict | None:
 def job_diario() -> None:
     require_env("GROUP_ID")
 
-    client = criar_cliente_genai()
+    with span("genai.criar_cliente"):
+        client = criar_cliente_genai()
     hoje = datetime.now().strftime("%Y-%m-%d")
     # Em TEST_MODE, usa uma "data" sintética pra não colidir com o registro real de hoje (UNIQUE)
     data_registro = f"{hoje}-teste-{int(time.time())}" if TEST_MODE else hoje
@@ -424,46 +597,74 @@ def job_diario() -> None:
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA synchronous=NORMAL;")
 
+    dono_lease = f"{os.getenv('GITHUB_RUN_ID', 'local')}-{os.getpid()}-{secrets.token_hex(4)}"
+    lease_adquirido = False
+
     try:
-        init_db(conn)
+        with span("db.init_db"):
+            init_db(conn)
         cursor = conn.cursor()
 
+        # Lease antes de checar/gerar: runs sobrepostos (cron, dispatch, push) não pagam o Gemini duas vezes
+        with span("db.lease", dono=dono_lease) as atributos:
+            lease_adquirido = adquirir_lease(conn, data_registro, dono_lease)
+            atributos["adquirido"] = lease_adquirido
+        if not lease_adquirido:
+            # Sai com erro: um outbox.txt antigo no disco não pode ser tomado como o de hoje
+            print("⚠️ Outro run está gerando o devocional de hoje. Encerrando.")
+            sys.exit(EXIT_LEASE_OCUPADO)
+
         if (not TEST_MODE) and ja_enviado_hoje(cursor, hoje):
             print("⚠️ Devocional de hoje já enviado. Encerrando.")
             return
 
-        devocional, referencia = gerar_devocional(client, cursor, hoje)
+        with span("gemini.gerar_devocional") as atributos:
+            devocional, referencia = gerar_devocional(
+                client, cursor, hoje,
+                heartbeat=lambda: renovar_lease(conn, data_registro, dono_lease),
+            )
+            atributos["referencia"] = referencia
 
         texto_final = f"""{devocional}""".strip()
 
         dados = parsear_referencia(referencia)
         hash_msg = hash_texto(devocional)
 
-        if not dados:
-            print("⚠️ Não consegui parsear referência. Salvando só o texto.")
-            cursor.execute(
-                """INSERT INTO devocionais (data, referencia, mensagem, hash_mensagem)
-                VALUES (?, ?, ?, ?)""",
-                (data_registro, referencia, texto_final, hash_msg),
-            )
-            conn.commit()
-        else:
-            livro_normalizado = normalizar_livro(dados['livro'])
-            cursor.execute(
-                """INSERT INTO devocionais
-                (data, referencia, mensagem, hash_mensagem, livro, capitulo, verso_inicial, verso_final)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                (data_registro, referencia, texto_final, hash_msg,
-                 livro_normalizado, dados['capitulo'], dados['verso_inicial'], dados['verso_final'])
-            )
-            conn.commit()
-            print(f"✅ Devocional gerado e salvo. Ref: {referencia}")
+        with span("db.salvar_devocional"):
+            if not dados:
+                print("⚠️ Não consegui parsear referência. Salvando só o texto.")
+                cursor.execute(
+                    """INSERT INTO devocionais (data, referencia, mensagem, hash_mensagem)
+                    VALUES (?, ?, ?, ?)""",
+                    (data_registro, referencia, texto_final, hash_msg),
+                )
+                conn.commit()
+            else:
+                livro_normalizado = normalizar_livro(dados['livro'])
+                cursor.execute(
+                    """INSERT INTO devocionais
+                    (data, referencia, mensagem, hash_mensagem, livro, capitulo, verso_inicial, verso_final)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (data_registro, referencia, texto_final, hash_msg,
+                     livro_normalizado, dados['capitulo'], dados['verso_inicial'], dados['verso_final'])
+                )
+                conn.commit()
+                print(f"✅ Devocional gerado e salvo. Ref: {referencia}")
 
         # Só escreve no outbox APÓS confirmação do BD — evita envio sem registro
         OUTBOX_PATH.write_text(texto_final, encoding="utf-8")
         print("✅ Mensagem salva em outbox.txt")
     finally:
+        if lease_adquirido:
+            # Descarta escrita pendente de uma falha antes de soltar o lease no mesmo commit
+            conn.rollback()
+            liberar_lease(conn, data_registro, dono_lease)
         conn.close()
 
 if __name__ == "__main__":
-    job_diario()
+    try:
+        with span("main.py", inicio_ns=_INICIO_PROCESSO_NS, test_mode=TEST_MODE):
+            registrar_span("import google.genai", _INICIO_PROCESSO_NS, _FIM_IMPORT_SDK_NS)
+            job_diario()
+    finally:
+        salvar_trace()
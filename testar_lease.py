@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+from pathlib import Path
+from datetime import datetime
+
+
+TEXTO_FALSO = """Olá, vamos à Palavra de hoje! 🙏
+
+📖 *Salmos 23:1-6 (NVI)*
+
+> 1 "O Senhor é o meu pastor; de nada terei falta."
+
+🧠 *Reflexão*
+
+Texto de teste.
+
+🙏 *Oração*
+
+Em nome de Jesus, Amém! 🤍"""
+
+
+def _worker(db_path: str, espera: float, largada) -> None:
+    """Roda o job_diario real com o Gemini trocado por um gerador falso que registra cada chamada."""
+    os.environ["LEASE_ESPERA_SEGUNDOS"] = str(espera)
+    os.environ["TEST_MODE"] = "0"
+    os.environ.setdefault("GROUP_ID", "teste@g.us")
+
+    import main as devocional
+
+    pasta = Path(db_path).parent
+    devocional.DB_PATH = Path(db_path)
+    devocional.OUTBOX_PATH = pasta / f"outbox-{os.getpid()}.txt"
+    devocional.criar_cliente_genai = lambda: None
+
+    def gerar_falso(client, cursor, data, heartbeat=None):
+        if heartbeat:
+            heartbeat()
+        with open(pasta / "geracoes.log", "a", encoding="utf-8") as f:
+            f.write(f"{os.getpid()}\n")
+        # Segura o lease tempo suficiente para os outros workers disputarem
+        time.sleep(1.0)
+        return TEXTO_FALSO, "Salmos 23:1-6 (NVI)"
+
+    devocional.gerar_devocional = gerar_falso
+
+    largada.wait()
+    devocional.job_diario()
+
+
+def rodar_cenario(nome: str, processos: int, espera: float, lease_morto: bool = False) -> bool:
+    """Dispara N processos no mesmo banco e confere: 1 geração, 1 registro no dia e lease liberado."""
+    print(f"\n🏁 {nome} ({processos} processos, LEASE_ESPERA_SEGUNDOS={espera:g})")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "database.db"
+        hoje = datetime.now().strftime("%Y-%m-%d")
+
+        if lease_morto:
+            import main as devocional
+
+            conn = sqlite3.connect(str(db_path))
+            devocional.init_db(conn)
+            conn.execute(
+                "INSERT INTO lease_execucao (chave, dono, heartbeat, expira_em) VALUES (?, ?, ?, ?)",
+                (hoje, "run-morto", time.time() - 700, time.time() - 100),
+            )
+            conn.commit()
+            conn.close()
+
+        ctx = multiprocessing.get_context("spawn")
+        largada = ctx.Event()
+        workers = [ctx.Process(target=_worker, args=(str(db_path), espera, largada)) for _ in range(processos)]
+        for w in workers:
+            w.start()
+        # Dá tempo dos imports terminarem para todos largarem juntos
+        time.sleep(3)
+        largada.set()
+        for w in workers:
+            w.join(timeout=120)
+
+        log = Path(tmp) / "geracoes.log"
+        geracoes = len(log.read_text(encoding="utf-8").splitlines()) if log.exists() else 0
+
+        conn = sqlite3.connect(str(db_path))
+        registros = conn.execute("SELECT COUNT(*) FROM devocionais WHERE data = ?", (hoje,)).fetchone()[0]
+        leases = conn.execute("SELECT COUNT(*) FROM lease_execucao").fetchone()[0]
+        conn.close()
+
+    import main as devocional
+
+    codigos = [w.exitcode for w in workers]
+    # 0 = gerou ou viu que já foi enviado; EXIT_LEASE_OCUPADO = outro run estava com o lease
+    codigos_ok = all(c in (0, devocional.EXIT_LEASE_OCUPADO) for c in codigos)
+
+    checagens = [
+        (f"1 geração no Gemini (foram {geracoes})", geracoes == 1),
+        (f"1 registro para {hoje} (foram {registros})", registros == 1),
+        (f"lease_execucao vazia ao final (linhas: {leases})", leases == 0),
+        (f"nenhum worker falhou com erro (códigos: {codigos})", codigos_ok),
+    ]
+    if espera > 0:
+        checagens.append(("todos saíram com 0 ao esperar o lease", all(c == 0 for c in codigos)))
+
+    for descricao, ok in checagens:
+        print(f"   {'✅' if ok else '❌'} {descricao}")
+
+    return all(ok for _, ok in checagens)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Testar o lease do run com processos disputando o mesmo banco")
+    parser.add_argument(
+        "--processos",
+        type=int,
+        default=6,
+        help="Quantidade de processos em paralelo"
+    )
+
+    args = parser.parse_args()
+
+    resultados = [
+        rodar_cenario("Banco novo, sem espera", args.processos, espera=0),
+        rodar_cenario("Banco novo, esperando o lease", args.processos, espera=30),
+        rodar_cenario("Lease expirado de um run morto", args.processos, espera=0, lease_morto=True),
+    ]
+
+    if all(resultados):
+        print("\n✅ Lease OK: exatamente uma geração por data.\n")
+    else:
+        print("\n❌ Lease falhou em algum cenário.\n")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()